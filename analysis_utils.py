@@ -1,31 +1,105 @@
-from moviepy.editor import VideoFileClip
 import parselmouth
 from parselmouth.praat import call, run_file
 import numpy as np
 import noisereduce as nr
 import os
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from numba import njit
 from scipy.io import wavfile
+from scipy.signal import resample_poly
 
 TOTAL_CRITERIA = 5
+PRAAT_SCRIPT_PATH = "script_content.praat"
+TARGET_SAMPLE_RATE = 16000
+
+try:
+    with open(PRAAT_SCRIPT_PATH, "r") as _script_file:
+        _PRAAT_SCRIPT = _script_file.read()
+except FileNotFoundError:
+    print("scriptissue")
+    _PRAAT_SCRIPT = None
+
+_EXECUTOR = None
+
+def init_executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _EXECUTOR
+
+@njit(cache=True)
+def _pitch_std(pitch_values, floor, ceiling):
+    total = 0.0
+    count = 0
+    for value in pitch_values:
+        if floor <= value <= ceiling:
+            total += value
+            count += 1
+    if count == 0:
+        return -1.0
+    mean = total / count
+    acc = 0.0
+    for value in pitch_values:
+        if floor <= value <= ceiling:
+            acc += (value - mean) ** 2
+    return np.sqrt(acc / count)
+
+
+@njit(cache=True)
+def _silence_kernel(intensity_values, times, threshold, min_duration):
+    n = len(intensity_values)
+    starts = np.empty(n, np.int64)
+    ends = np.empty(n, np.int64)
+    count = 0
+    in_run = False
+    run_start = 0
+    for i in range(n):
+        silent = intensity_values[i] < threshold
+        if silent and not in_run:
+            in_run = True
+            run_start = i
+        elif not silent and in_run:
+            in_run = False
+            if times[i - 1] - times[run_start] >= min_duration:
+                starts[count] = run_start
+                ends[count] = i - 1
+                count += 1
+    if in_run and times[n - 1] - times[run_start] >= min_duration:
+        starts[count] = run_start
+        ends[count] = n - 1
+        count += 1
+    return starts[:count], ends[:count]
+
+
+# pre-warm so JIT compilation happens at import, not on the first request
+_pitch_std(np.zeros(2), 75.0, 400.0)
+_silence_kernel(np.zeros(2), np.zeros(2), 40.0, 0.5)
+
+
+def load_waveform(audio_file_path):
+    sr, samples = wavfile.read(audio_file_path)
+    if np.issubdtype(samples.dtype, np.integer):
+        samples = samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    else:
+        samples = samples.astype(np.float32, copy=False)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if sr > TARGET_SAMPLE_RATE and sr % TARGET_SAMPLE_RATE == 0:
+        samples = resample_poly(samples, 1, sr // TARGET_SAMPLE_RATE).astype(np.float32)
+        sr = TARGET_SAMPLE_RATE
+    return sr, samples
 
-def analyze_pitch(audio_data):
-    try:
-        sr, sound_values = wavfile.read(audio_data)
-        if sound_values.ndim > 1:  
-            sound_values = sound_values[:,0]
 
-        sound = parselmouth.Sound(sound_values, sampling_frequency=sr)
-        
+def analyze_pitch(sound):
+    try:
         pitch = sound.to_pitch()
         pitch_values = pitch.selected_array['frequency']
-        
-        pitch_values_filtered = pitch_values[(pitch_values > 0) & (pitch_values >= 75) & (pitch_values <= 400)]
-        if len(pitch_values_filtered) == 0:
+
+        std_dev = _pitch_std(np.ascontiguousarray(pitch_values), 75.0, 400.0)
+        if std_dev < 0:
             print("No valid pitch values found.")
-            return None  
+            return None
 
-        std_dev = np.std(pitch_values_filtered)
         return {"pitch": std_dev}
     except Exception as e:
         print("Exception analyzepitch")
@@ -42,15 +116,16 @@ def classify_speaker(std_dev):
     else:
         return "Unbalanced"
 
-def analyze_volume(audio_data):
-    snd = parselmouth.Sound(audio_data)
+# Praat intensity is dB re 2e-5 Pa; the same reference keeps the 45/75 thresholds valid
+_DB_CALIBRATION_OFFSET = 20 * np.log10(1 / 2e-5)
 
-    intensity = snd.to_intensity()
-    average_intensity = np.mean(intensity.values) if intensity.values.size > 0 else None
-    if average_intensity is None:
+def analyze_volume(samples):
+    if samples.size == 0:
         print("Exception volume")
-        return "Unknown volume"  
-    
+        return "Unknown volume"
+    rms = np.sqrt(np.mean(np.square(samples.astype(np.float32, copy=False))))
+    average_intensity = 20 * np.log10(rms + 1e-12) + _DB_CALIBRATION_OFFSET
+
     low_threshold = 45  
     high_threshold = 75 
 
@@ -61,36 +136,25 @@ def analyze_volume(audio_data):
     else:
         return "Volume is ideal"    
 
-def analyze_silences(sound, noise_reduction=True, silence_threshold=40, min_silence_duration=0.5):
+def analyze_silences(sound, intensity=None, noise_reduction=False, silence_threshold=40, min_silence_duration=0.5):
     try:
         if noise_reduction:
-            audio_data = sound.values[0]  
+            audio_data = sound.values[0]
             sampling_rate = sound.sampling_frequency
-            noise_clip = audio_data[:int(sampling_rate * 0.5)]  
-            reduced_noise_audio = nr.reduce_noise(y=audio_data, y_noise=noise_clip, sr=sampling_rate)
+            noise_clip = audio_data[:int(sampling_rate * 0.5)]
+            reduced_noise_audio = nr.reduce_noise(y=audio_data, y_noise=noise_clip, sr=sampling_rate,
+                                                  stationary=True, n_fft=512, hop_length=128)
             sound = parselmouth.Sound(reduced_noise_audio, sampling_rate)
+            intensity = None
 
-        intensity = sound.to_intensity()
+        if intensity is None:
+            intensity = sound.to_intensity()
         intensity_values = intensity.values[0]
-        times = intensity.xs()
-
-        silences = []
-        current_silence = None
-        for time, value in zip(times, intensity_values):
-            if value < silence_threshold:
-                if current_silence is None:
-                    current_silence = [time, None]
-                continue
-            if current_silence is not None:
-                current_silence[1] = time if current_silence[1] is None else current_silence[1]
-                if current_silence[1] - current_silence[0] >= min_silence_duration:
-                    silences.append(current_silence)
-                current_silence = None
-
-        if current_silence is not None and current_silence[1] is None:
-            current_silence[1] = times[-1]  
-            if current_silence[1] - current_silence[0] >= min_silence_duration:
-                silences.append(current_silence)
+        times = np.asarray(intensity.xs())
+
+        starts, ends = _silence_kernel(intensity_values, times,
+                                       float(silence_threshold), float(min_silence_duration))
+        silences = [[times[start], times[end]] for start, end in zip(starts, ends)]
 
         return silences
     except Exception as e:
@@ -115,66 +179,52 @@ def classify_silences(silences, total_duration_threshold=15, initial_delay_thres
     else:
         return "normal"
 
-def segment_audio(sound, segment_length=15.0):
+def segment_audio(samples, sampling_rate, segment_length=15.0):
     try:
-        segments = []
-        for start_time in np.arange(0, sound.duration, segment_length):
-            end_time = start_time + segment_length
-            if end_time > sound.duration:
-                end_time = sound.duration
-            segment = sound.extract_part(from_time=start_time, to_time=end_time, preserve_times=True)
-            segments.append(segment)
-        return segments
+        step = int(segment_length * sampling_rate)
+        return [samples[i:i + step] for i in range(0, len(samples), step)]
     except Exception as e:
         print(f"Error in segment_audio: {e}")
         return []
 
 
-def analyze_segment(segment, praat_script_path, path):
-    praat_script_path = "script_content.praat"
-    try:
-        with open(praat_script_path, "r") as file:
-            praat_script_content = file.read()
-    except FileNotFoundError:
-        return None 
-    with tempfile.NamedTemporaryFile("w", delete=False) as script_file:
-        script_file.write(praat_script_content)
-        temp_script_path = script_file.name
-    
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        audio_file_path = tmp.name
-        segment.save(audio_file_path, "WAV")
-        objects = run_file(temp_script_path, -20, 2, 0.3, "yes", audio_file_path, path, 80, 400, 0.01, capture_output=True)
-        os.remove(audio_file_path)
-    
-    os.remove(temp_script_path) 
-    z1 = str(objects[1])
-    z2 = z1.strip().split()
-    return z2
-
-def average_score(audio_file_path: str, praat_script_path: str, path: str, score_index: int):
-    praat_script_path = "script_content.praat"    
-    try:
-        with open(praat_script_path, "r") as file:
-            praat_script_content = file.read()
-    except FileNotFoundError:
+def write_temp_script(scratch_dir):
+    if _PRAAT_SCRIPT is None:
         print("scriptissue")
-        return None  
-    with tempfile.NamedTemporaryFile("w", delete=False) as script_file:
-        script_file.write(praat_script_content)
-        sourcerun = script_file.name  
-    sound = parselmouth.Sound(audio_file_path)
-    segments = segment_audio(sound)
-    scores = []
-    for segment in segments:
-        z2 = analyze_segment(segment, sourcerun, path)
-        if len(z2) > max(14, score_index):
-            scores.append(float(z2[score_index]))
-    if not scores:  
-        return None  
-    average_score = np.mean(scores)
-    os.remove(sourcerun)
-    return average_score
+        return None
+    script_path = os.path.join(scratch_dir, "script.praat")
+    with open(script_path, "w") as script_file:
+        script_file.write(_PRAAT_SCRIPT)
+    return script_path
+
+
+def _run_segment(args):
+    audio_file_path, temp_script_path, path, score_indices = args
+    objects = run_file(temp_script_path, -20, 2, 0.3, "yes", audio_file_path, path, 80, 400, 0.01, capture_output=True)
+    fields = str(objects[1]).rstrip().split('\t')
+    try:
+        return tuple(float(fields[score_index]) for score_index in score_indices)
+    except (IndexError, ValueError):
+        return None
+
+def average_score(segments, sampling_rate: int, temp_script_path: str, score_indices=(14, 3)):
+    if temp_script_path is None:
+        return tuple(None for _ in score_indices)
+    scratch_dir = os.path.dirname(temp_script_path)
+    segment_paths = []
+    for i, segment in enumerate(segments):
+        wav_path = os.path.join(scratch_dir, f"seg_{i}.wav")
+        wavfile.write(wav_path, sampling_rate, segment.astype(np.float32, copy=False))
+        segment_paths.append(wav_path)
+    executor = init_executor()
+    results = list(executor.map(_run_segment, [(wav_path, temp_script_path, scratch_dir, score_indices) for wav_path in segment_paths]))
+    score_lists = [[] for _ in score_indices]
+    for result in results:
+        if result is None:
+            continue
+        for scores, value in zip(score_lists, result):
+            scores.append(value)
+    return tuple(np.mean(scores) if scores else None for scores in score_lists)
 
 
 def calculate_score(positive_criteria_count, available_criteria_count):
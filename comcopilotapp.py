@@ -1,64 +1,104 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from moviepy.editor import VideoFileClip
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse
+from blake3 import blake3
+from collections import OrderedDict
 import parselmouth
 from parselmouth.praat import call, run_file
 import numpy as np
 import noisereduce as nr
+import asyncio
 import os
+import shutil
+import subprocess
 import tempfile
 import analysis_utils
-from typing import Dict, Any
+from typing import Dict, Any, List
 from scipy.io import wavfile
 import logging
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 TOTAL_CRITERIA = 5
 PRAAT_SCRIPT_PATH = "script_content.praat"
+ANALYSIS_CACHE_SIZE = 128
+
+_analysis_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+def startup_event():
+    analysis_utils.init_executor()
+
+async def analyze_video_core(file: UploadFile, background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    hasher = blake3()
+    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as video_file:
+        while chunk := await file.read(1 << 20):
+            hasher.update(chunk)
+            video_file.write(chunk)
+        video_file.flush()
+
+    video_file_path = video_file.name
+    digest = hasher.hexdigest()
+    cached = _analysis_cache.get(digest)
+    if cached is not None:
+        _analysis_cache.move_to_end(digest)
+        background_tasks.add_task(cleanup_files, [video_file_path])
+        return cached
+
+    audio_file_path = convert_video_to_audio(video_file_path)
+
+    if not audio_file_path:
+        logger.error("Failed to convert video to audio.")
+        response_data = {"error": "Failed to convert video to audio."}
+    else:
+        analysis_results = await perform_analysis(audio_file_path)
+        response_data = prepare_response_data(analysis_results)
+        if analysis_results["succeeded"]:
+            _analysis_cache[digest] = response_data
+            if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+                _analysis_cache.popitem(last=False)
+
+    background_tasks.add_task(cleanup_files, [video_file_path, audio_file_path])
+    return response_data
+
 @app.post("/video/analysis/")
-async def analyze_video(file: UploadFile = File(...)):
+async def analyze_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     try:
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as video_file:
-            contents = await file.read()
-            video_file.write(contents)
-            video_file.flush()
-
-        video_file_path = video_file.name
-        audio_file_path = convert_video_to_audio(video_file_path)
-        
-        if not audio_file_path:
-            logger.error("Failed to convert video to audio.")
-            response_data = {"error": "Failed to convert video to audio."}
-        else:
-            analysis_results = perform_analysis(audio_file_path)
-            response_data = prepare_response_data(analysis_results)
-        
-        cleanup_files([video_file_path, audio_file_path])
-        return JSONResponse(content=response_data)
+        response_data = await analyze_video_core(file, background_tasks)
+        return ORJSONResponse(content=response_data)
     except Exception as e:
         logger.exception("Exception occurred during video analysis")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/video/analysis/batch/")
+async def analyze_video_batch(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
+    semaphore = asyncio.Semaphore(max(1, (os.cpu_count() or 2) // 2))
+
+    async def analyze_one(upload):
+        async with semaphore:
+            return await analyze_video_core(upload, background_tasks)
+
+    results = await asyncio.gather(*(analyze_one(upload) for upload in files), return_exceptions=True)
+    response_data = [{"error": str(result)} if isinstance(result, Exception) else result
+                     for result in results]
+    return ORJSONResponse(content=response_data)
+
 def convert_video_to_audio(video_file_path: str) -> str:
     try:
-        video_clip = VideoFileClip(video_file_path)
         audio_file_path = tempfile.mktemp(suffix=".wav")
-        video_clip.audio.write_audiofile(audio_file_path, codec='pcm_s16le')
-        video_clip.close()  # Ensure resources are released
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", video_file_path, "-vn", "-ac", "1", "-ar", "16000",
+             "-acodec", "pcm_s16le", audio_file_path],
+            check=True, capture_output=True)
         return audio_file_path
     except Exception as e:
         logger.exception("Error converting video to audio")
         return ""
 
-def perform_analysis(audio_file_path: str) -> Dict[str, Any]:
+async def perform_analysis(audio_file_path: str) -> Dict[str, Any]:
     available_criteria_count = 5
-    praat_script_path = PRAAT_SCRIPT_PATH
-    path = os.path.dirname(audio_file_path)
 
     analysis_results = {
         "pitch": {"characteristic": "Error: Analysis failed"},
@@ -66,24 +106,35 @@ def perform_analysis(audio_file_path: str) -> Dict[str, Any]:
         "silence": {"characteristic": "Error: Analysis failed"},
         "pronunciation": {"score": 0},
         "articulation": {"rate": 0},
-        "overall_score": 0
+        "overall_score": 0,
+        "succeeded": False
     }
 
     try:
-        sound = parselmouth.Sound(audio_file_path)
-        
-        pitch_analysis_result = analysis_utils.analyze_pitch(audio_file_path)
+        sr, samples = analysis_utils.load_waveform(audio_file_path)
+        sound = parselmouth.Sound(samples, sampling_frequency=sr)
+        intensity = sound.to_intensity()
+        segments = analysis_utils.segment_audio(samples, sr)
+        scratch_dir = tempfile.mkdtemp()
+        try:
+            temp_script_path = analysis_utils.write_temp_script(scratch_dir)
+            pitch_task = asyncio.to_thread(analysis_utils.analyze_pitch, sound)
+            volume_task = asyncio.to_thread(analysis_utils.analyze_volume, samples)
+            silence_task = asyncio.to_thread(analysis_utils.analyze_silences, sound, intensity)
+            score_task = asyncio.to_thread(analysis_utils.average_score, segments, sr,
+                                           temp_script_path, (14, 3))
+            pitch_analysis_result, volume_result, silences, scores = await asyncio.gather(
+                pitch_task, volume_task, silence_task, score_task)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
         pitch_result = "Error: Pitch analysis failed"
         if pitch_analysis_result and "pitch" in pitch_analysis_result:
             pitch_std_dev = pitch_analysis_result["pitch"]
             pitch_result = analysis_utils.classify_speaker(pitch_std_dev)
 
-        volume_result = analysis_utils.analyze_volume(sound)
-        silences = analysis_utils.analyze_silences(sound)
         silence_result = analysis_utils.classify_silences(silences)
-        segments = analysis_utils.segment_audio(sound)
-        pronunciation_score = analysis_utils.average_score(audio_file_path, praat_script_path, os.path.dirname(audio_file_path), 14)
-        articulation_rate = analysis_utils.average_score(audio_file_path, praat_script_path, os.path.dirname(audio_file_path), 3)
+        pronunciation_score, articulation_rate = scores
         available_criteria_count = 5
         positive_criteria_count = (1 if pitch_result == "Balanced" else 0) + \
                                   (1 if volume_result == "Volume is ideal" else 0) + \
@@ -99,7 +150,8 @@ def perform_analysis(audio_file_path: str) -> Dict[str, Any]:
             "silence": {"characteristic": silence_result},
             "pronunciation": {"score": pronunciation_score},
             "articulation": {"rate": articulation_rate},
-            "overall_score": {"score": overall_score}
+            "overall_score": {"score": overall_score},
+            "succeeded": True
         })
     except Exception as e:
         logger.exception("Error during analysis")